@@ -1,17 +1,22 @@
 #!/usr/bin/env python3
 """
-Telegram rotating-channel gatekeeper bot (private channels) + Flask web service (Render).
+Telegram rotating-channel gatekeeper bot (private channels) + ASGI health endpoint (Render).
 """
 
 import os
-import json
+import re
+import asyncio
+import threading
+import time
 import logging
 import pathlib
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 
+import orjson
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
-from flask import Flask
+from telegram.error import BadRequest
+from telegram.request import HTTPXRequest
 
 # ----------------- CONFIG -----------------
 BOT_TOKEN = os.getenv("BOT_TOKEN")  # must be set in Render environment variables
@@ -31,215 +36,567 @@ CHANNEL_FILES = [
 ]
 
 STATE_PATH = pathlib.Path("bot_state.json")
+STATE_FLUSH_INTERVAL = 1.0  # seconds to coalesce state changes before writing
+MEMBER_CACHE_TTL = 10.0  # seconds a positive get_chat_member result is reused
+MEMBER_CACHE_MAX = 10_000  # prune expired entries once the cache grows past this
+POLL_TIMEOUT = 30  # seconds Telegram holds a getUpdates long poll open
+API_POOL_SIZE = 64  # pooled HTTP connections shared by handler API calls
+CONCURRENT_UPDATES = 64  # updates PTB may process at the same time
+TG_CONCURRENCY = 20  # max Telegram API calls in flight at once
 REQUIRED_JOINS = 2  # 🔑 number of joins needed before advancing
+VERIFY_RE = re.compile(r"^verify_(\d+)$")  # callback_data of the Verify button
 # ------------------------------------------
 
+# Validate the config at startup rather than midway through a handler
+if len(CHANNEL_FILES) != len(CHANNELS):
+    raise RuntimeError("❌ CHANNEL_FILES must have one entry per channel in CHANNELS.")
+if REQUIRED_JOINS < 1:
+    raise RuntimeError("❌ REQUIRED_JOINS must be at least 1.")
+
+# Derived once from the config for the hot paths
+NUM_CHANNELS = len(CHANNELS)
+CHANNEL_IDS = tuple(c["id"] for c in CHANNELS)
+
 # Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Flask app
-app = Flask(__name__)
+# Health endpoint: a bare ASGI app, so Render's checks skip Flask/WSGI entirely
+INDEX_BODY = "✅ Telegram bot is running on Render!".encode("utf-8")
+TEXT_HEADERS = [(b"content-type", b"text/plain; charset=utf-8")]
+
+
+async def health(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
 
-@app.route("/")
-def index():
-    return "✅ Telegram bot + Flask is running on Render!"
+    if scope["path"] == "/":
+        status, body = 200, INDEX_BODY
+    else:
+        status, body = 404, b"Not Found"
+    await send({"type": "http.response.start", "status": status, "headers": TEXT_HEADERS})
+    await send({"type": "http.response.body", "body": body})
 
 
 # ---------- State helpers ----------
+def empty_channel_state() -> Dict[str, Any]:
+    return {"counted": set()}
+
+
 def default_state() -> Dict[str, Any]:
     return {
         "active_index": 0,
-        "channels": [{"joined": 0, "counted": []} for _ in CHANNELS],
+        "channels": [empty_channel_state() for _ in range(NUM_CHANNELS)],
+        "file_ids": {},
     }
 
 
 def load_state() -> Dict[str, Any]:
-    if STATE_PATH.exists():
-        try:
-            with open(STATE_PATH, "r", encoding="utf-8") as f:
-                state = json.load(f)
-        except Exception as e:
-            logger.exception("Failed to load state file, starting fresh: %s", e)
-            state = default_state()
-    else:
+    try:
+        raw = STATE_PATH.read_bytes()
+        state = orjson.loads(raw) if raw else default_state()
+    except FileNotFoundError:
+        state = default_state()
+    except Exception as e:
+        logger.exception("Failed to load state file, starting fresh: %s", e)
         state = default_state()
 
     if "active_index" not in state:
         state["active_index"] = 0
+    if not isinstance(state.get("file_ids"), dict):
+        state["file_ids"] = {}
     if "channels" not in state or not isinstance(state["channels"], list):
-        state["channels"] = [{"joined": 0, "counted": []} for _ in CHANNELS]
+        state["channels"] = [empty_channel_state() for _ in range(NUM_CHANNELS)]
 
-    while len(state["channels"]) < len(CHANNELS):
-        state["channels"].append({"joined": 0, "counted": []})
-    if len(state["channels"]) > len(CHANNELS):
-        state["channels"] = state["channels"][: len(CHANNELS)]
+    while len(state["channels"]) < NUM_CHANNELS:
+        state["channels"].append(empty_channel_state())
+    if len(state["channels"]) > NUM_CHANNELS:
+        state["channels"] = state["channels"][:NUM_CHANNELS]
+
+    # user-id collections are stored as lists on disk but kept as sets in memory;
+    # the join count is len(counted), so a legacy "joined" counter is discarded
+    for ch in state["channels"]:
+        ch.pop("joined", None)
+        ch["counted"] = set(ch.get("counted", ()))
 
     return state
 
 
-def save_state(state: Dict[str, Any]):
+def _encode_set(o):
+    if isinstance(o, set):
+        return sorted(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def encode_state(state: Dict[str, Any]) -> bytes:
+    return orjson.dumps(state, default=_encode_set)
+
+
+# Writes run both in worker threads and (at shutdown) on the loop thread; they
+# share one temp file, so only one may be in progress at a time.
+_write_lock = threading.Lock()
+
+
+def write_state_bytes(data: bytes) -> bool:
+    """Atomically replace bot_state.json with data. Returns False if the write failed."""
+    tmp_path = STATE_PATH.with_suffix(".json.tmp")
+    with _write_lock:
+        try:
+            # one buffered write + fsync, then atomic rename over the old file
+            with open(tmp_path, "wb", buffering=1 << 20) as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, STATE_PATH)
+        except Exception as e:
+            logger.exception("Failed to save state: %s", e)
+            return False
+    return True
+
+
+def save_state(state: Dict[str, Any]) -> bool:
     try:
-        with open(STATE_PATH, "w", encoding="utf-8") as f:
-            json.dump(state, f, indent=2)
+        data = encode_state(state)
     except Exception as e:
-        logger.exception("Failed to save state: %s", e)
+        logger.exception("Failed to encode state: %s", e)
+        return False
+    return write_state_bytes(data)
+
+
+# In-memory state: loaded once in _post_init, mutated under STATE_LOCK, flushed in
+# the background.
+STATE: Dict[str, Any] = {}
+# asyncio primitives are created in _post_init, inside the running loop: on
+# Python <= 3.9 they bind to the loop current at construction, and uvloop
+# replaces the loop policy after import.
+STATE_LOCK: Optional[asyncio.Lock] = None
+SAVE_QUEUE: "Optional[asyncio.Queue[None]]" = None
+_state_dirty = False
+_inflight_write: Optional[asyncio.Future] = None
+
+
+def mark_dirty():
+    """Record a state change and wake the writer; never blocks the caller."""
+    global _state_dirty
+    _state_dirty = True
+    if SAVE_QUEUE is None:
+        return  # writer not started yet; the shutdown flush still sees the flag
+    try:
+        SAVE_QUEUE.put_nowait(None)
+    except asyncio.QueueFull:
+        pass  # a write is already queued and will pick up the whole state
+
+
+def flush_state():
+    global _state_dirty
+    if _state_dirty:
+        _state_dirty = False
+        if not save_state(STATE):
+            _state_dirty = True  # keep the change pending so a later flush retries
+
+
+async def _writer():
+    """Single consumer of SAVE_QUEUE: coalesces queued changes into one write."""
+    global _state_dirty, _inflight_write
+    while True:
+        await SAVE_QUEUE.get()
+        # let a burst of updates land before taking the snapshot
+        await asyncio.sleep(STATE_FLUSH_INTERVAL)
+        # snapshot under the lock, then write from a worker thread so disk I/O
+        # never blocks the event loop (or other handlers waiting on the lock)
+        async with STATE_LOCK:
+            while not SAVE_QUEUE.empty():
+                SAVE_QUEUE.get_nowait()
+            if not _state_dirty:
+                continue
+            _state_dirty = False
+            try:
+                data = encode_state(STATE)
+            except Exception as e:
+                logger.exception("Failed to encode state: %s", e)
+                continue
+        # shielded: cancelling the writer must not abandon a write mid-flight,
+        # shutdown awaits _inflight_write before its final flush
+        _inflight_write = asyncio.ensure_future(asyncio.to_thread(write_state_bytes, data))
+        if not await asyncio.shield(_inflight_write):
+            mark_dirty()  # retry on the next cycle (or the shutdown flush)
 
 
 # ---------- Helpers ----------
+TG_SEM: Optional[asyncio.Semaphore] = None  # created in _post_init
+
+
+async def tg_call(func, *args, **kwargs):
+    """
+    Call a Telegram API method, keeping at most TG_CONCURRENCY in flight. The
+    coroutine is only created once a slot is free, so a caller cancelled while
+    waiting leaves nothing un-awaited behind.
+    """
+    async with TG_SEM:
+        return await func(*args, **kwargs)
+
+
+MEMBER_STATUSES = ("member", "administrator", "creator")
+
+# (channel_id, user_id) -> (status, expiry on the time.monotonic() clock). Only
+# member statuses are cached: a "left" user may join any second, and telling
+# them to join again would be wrong, while a cached positive is merely late.
+_member_cache: Dict[Tuple[int, int], Tuple[str, float]] = {}
+
+
+def _prune_member_cache(now: float):
+    for key in [k for k, (_, expiry) in _member_cache.items() if expiry <= now]:
+        del _member_cache[key]
+
+
 async def is_member(bot, channel_id: int, user_id: int) -> bool:
+    key = (channel_id, user_id)
+    now = time.monotonic()
+    hit = _member_cache.get(key)
+    if hit and hit[1] > now:
+        status = hit[0]
+    else:
+        try:
+            res = await tg_call(bot.get_chat_member, chat_id=channel_id, user_id=user_id)
+        except Exception as e:
+            logger.warning("get_chat_member failed for channel_id=%s user=%s: %s", channel_id, user_id, e)
+            return False
+        status = res.status
+        if status in MEMBER_STATUSES:
+            if len(_member_cache) >= MEMBER_CACHE_MAX:
+                _prune_member_cache(now)
+            _member_cache[key] = (status, now + MEMBER_CACHE_TTL)
+    return status in MEMBER_STATUSES
+
+
+def _read_channel_file(name: Optional[str]) -> Optional[Tuple[str, bytes]]:
+    if not name:
+        return None
+    path = pathlib.Path(name)
     try:
-        res = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
-        return res.status in ("member", "administrator", "creator")
+        return path.name, path.read_bytes()
+    except FileNotFoundError:
+        return None
     except Exception as e:
-        logger.warning("get_chat_member failed for channel_id=%s user=%s: %s", channel_id, user_id, e)
-        return False
+        logger.warning("Failed to read channel file %s: %s", path, e)
+        return None
 
 
-async def send_channel_files(target, channel_idx: int):
-    files = CHANNEL_FILES[channel_idx]
+def _file_key(name: Optional[str]) -> Optional[str]:
+    """Identify a file's current content as name:size:mtime, or None if it is missing."""
+    if not name:
+        return None
+    try:
+        st = os.stat(name)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("Failed to stat channel file %s: %s", name, e)
+        return None
+    return f"{name}:{st.st_size}:{st.st_mtime_ns}"
 
-    text_path = files.get("text")
-    if text_path:
-        text_path = pathlib.Path(text_path)
-        if text_path.exists():
-            try:
-                with open(text_path, "rb") as f:
-                    await target.reply_document(f)
-            except Exception as e:
-                logger.exception("Failed to send text/document: %s", e)
 
-    video_path = files.get("video")
-    if video_path:
-        video_path = pathlib.Path(video_path)
-        if video_path.exists():
+def preload_channel_files(file_ids: Dict[str, str]) -> Tuple[list, list]:
+    """
+    Stat and read every channel file once. Returns, per channel, {kind: file key}
+    and {kind: (filename, bytes)}. Missing files are skipped, and files Telegram
+    already has (a file_id stored under the current key) are not read.
+    """
+    keys, cache = [], []
+    for files in CHANNEL_FILES:
+        channel_keys, loaded = {}, {}
+        for kind, name in files.items():
+            key = _file_key(name)
+            if key is None:
+                continue
+            channel_keys[kind] = key
+            if key in file_ids:
+                continue
+            data = _read_channel_file(name)
+            if data is not None:
+                loaded[kind] = data
+        keys.append(channel_keys)
+        cache.append(loaded)
+    return keys, cache
+
+
+# Channel files are small and fixed, so they are read once (in _post_init).
+CHANNEL_FILE_KEYS: list = []
+CHANNEL_FILES_CACHE: list = []
+
+# kind -> (reply method, parameter / Message attribute holding the media)
+_FILE_KINDS = (
+    ("text", "reply_document", "document"),
+    ("video", "reply_video", "video"),
+)
+
+
+async def _send_channel_file(target, channel_idx: int, kind: str, method: str, field: str):
+    """
+    Send by the file_id Telegram returned for an earlier upload, falling back to
+    uploading the bytes. file_ids live in STATE["file_ids"] keyed by name, size
+    and mtime, and are persisted, so after the first upload no file bytes are
+    sent again, while a replaced file gets a fresh key and is uploaded anew.
+    """
+    name = CHANNEL_FILES[channel_idx][kind]
+    key = CHANNEL_FILE_KEYS[channel_idx].get(kind)
+    if key is None:
+        return  # file was missing at startup
+    send = getattr(target, method)
+    file_id = STATE["file_ids"].get(key)
+    try:
+        if file_id:
             try:
-                with open(video_path, "rb") as v:
-                    await target.reply_video(video=v)
-            except Exception as e:
-                logger.exception("Failed to send video: %s", e)
+                await tg_call(send, **{field: file_id})
+                return
+            except BadRequest as e:
+                # other BadRequests (chat/reply errors) say nothing about the id
+                if "file identifier" not in e.message.lower():
+                    raise
+                logger.warning("Cached file_id for %s was rejected, re-uploading: %s", name, e)
+                async with STATE_LOCK:
+                    STATE["file_ids"].pop(key, None)
+                    mark_dirty()
+
+        loaded = CHANNEL_FILES_CACHE[channel_idx].get(kind)
+        if loaded is None and file_id:
+            # not preloaded because the id was known; read it now to re-upload
+            loaded = await asyncio.to_thread(_read_channel_file, name)
+        if loaded is None:
+            return
+
+        filename, data = loaded
+        msg = await tg_call(send, **{field: data, "filename": filename})
+        async with STATE_LOCK:
+            STATE["file_ids"][key] = getattr(msg, field).file_id
+            mark_dirty()
+        # Telegram has the file now, the preloaded bytes are no longer needed
+        CHANNEL_FILES_CACHE[channel_idx].pop(kind, None)
+    except Exception as e:
+        logger.warning("Failed to send %s: %s", name, e)
+
+
+async def send_channel_files(target, channel_idx: int):
+    for kind, method, field in _FILE_KINDS:
+        if CHANNEL_FILES[channel_idx].get(kind):
+            await _send_channel_file(target, channel_idx, kind, method, field)
 
-REQUIRED_JOINS = 2  # change this to any number you like
 
-def advance_if_needed() -> bool:
+def advance_if_needed(state: Dict[str, Any]) -> bool:
     """
     Check if current channel has enough joins. If yes, reset and advance.
-    Returns True if advanced, False otherwise.
+    Returns True if advanced, False otherwise. Caller must hold STATE_LOCK
+    and is responsible for persisting the change.
     """
-    state = load_state()
     idx = state["active_index"]
     ch = state["channels"][idx]
 
-    if ch.get("joined", 0) >= REQUIRED_JOINS:
+    if len(ch["counted"]) >= REQUIRED_JOINS:
         # ✅ reset counter for current channel
-        ch["joined"] = 0
-        ch["counted"] = []
+        ch["counted"].clear()
 
         # ✅ move to next channel (looping back at end)
-        state["active_index"] = (idx + 1) % len(CHANNELS)
-        save_state(state)
+        state["active_index"] = (idx + 1) % NUM_CHANNELS
 
-        logger.info(f"🚀 Channel {idx+1} reached {REQUIRED_JOINS} users. "
-                    f"Now moving to Channel {state['active_index']+1}.")
+        logger.info("🚀 Channel %d reached %d users. Now moving to Channel %d.",
+                    idx + 1, REQUIRED_JOINS, state["active_index"] + 1)
         return True
 
-    save_state(state)
     return False
 
 
-
 # ---------- Handlers ----------
+# Per-channel reply markup and prompt never change, so build them once.
+KEYBOARDS = [
+    InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("👉 Join Channel", url=channel["invite"]),
+            InlineKeyboardButton("✅ Verify", callback_data=f"verify_{i}"),
+        ]
+    ])
+    for i, channel in enumerate(CHANNELS)
+]
+JOIN_PROMPTS = [
+    f"📢 Please join Channel {i+1} to unlock the files. After joining, press Verify.\n\n"
+    for i in range(NUM_CHANNELS)
+]
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    state = load_state()
-    idx = state["active_index"]
+    async with STATE_LOCK:
+        idx = STATE["active_index"]
+        joined = len(STATE["channels"][idx]["counted"])
 
-    channel = CHANNELS[idx]
-    invite = channel["invite"]
-    channel_id = channel["id"]
+    channel_id = CHANNEL_IDS[idx]
 
-    progress = f"📊 Progress: {state['channels'][idx]['joined']}/{REQUIRED_JOINS} users verified."
+    progress = f"📊 Progress: {joined}/{REQUIRED_JOINS} users verified."
 
     if await is_member(context.bot, channel_id, user.id):
-        await update.message.reply_text(
-            f"✅ You are already a member of Channel {idx+1}. Sending files...\n\n{progress}"
+        await tg_call(
+            update.message.reply_text,
+            f"✅ You are already a member of Channel {idx+1}. Sending files...\n\n{progress}",
         )
         await send_channel_files(update.message, idx)
         return
 
-    keyboard = [
-        [
-            InlineKeyboardButton("👉 Join Channel", url=invite),
-            InlineKeyboardButton("✅ Verify", callback_data=f"verify_{idx}"),
-        ]
-    ]
-    await update.message.reply_text(
-        f"📢 Please join Channel {idx+1} to unlock the files. After joining, press Verify.\n\n{progress}",
-        reply_markup=InlineKeyboardMarkup(keyboard),
-    )
+    await tg_call(update.message.reply_text, JOIN_PROMPTS[idx] + progress, reply_markup=KEYBOARDS[idx])
 
 
 async def verify_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
+    await tg_call(query.answer)
 
     user = update.effective_user
-    state = load_state()
-    idx = state["active_index"]
-    ch = state["channels"][idx]
+    async with STATE_LOCK:
+        idx = STATE["active_index"]
+        ch = STATE["channels"][idx]
 
-    # ensure fields exist
-    if "joined" not in ch:
-        ch["joined"] = 0
-    if "counted" not in ch:
-        ch["counted"] = []
+        # avoid double-counting
+        newly_counted = user.id not in ch["counted"]
+        if newly_counted:
+            ch["counted"].add(user.id)
+            logger.info("✅ User %s verified in Channel %d. Total = %d",
+                        user.id, idx + 1, len(ch["counted"]))
 
-    # avoid double-counting
-    if user.id not in ch["counted"]:
-        ch["joined"] += 1
-        ch["counted"].append(user.id)
-        save_state(state)
-        logger.info(f"✅ User {user.id} verified in Channel {idx+1}. "
-                    f"Total = {ch['joined']}")
+        joined = len(ch["counted"])
 
-    # check if we need to advance
-    advanced = advance_if_needed()
+        # check if we need to advance
+        advanced = advance_if_needed(STATE)
+        next_idx = STATE["active_index"]
+
+        # one save request per handler, covering both mutations
+        if newly_counted or advanced:
+            mark_dirty()
 
     if advanced:
-        await query.edit_message_text(
-            f"🎉 Channel {idx+1} completed! Now moving to Channel {state['active_index']+1}."
+        await tg_call(
+            query.edit_message_text,
+            f"🎉 Channel {idx+1} completed! Now moving to Channel {next_idx+1}.",
         )
     else:
-        await query.edit_message_text(
+        await tg_call(
+            query.edit_message_text,
             f"👍 You’ve been counted in Channel {idx+1}. "
-            f"Progress: {ch['joined']}/{REQUIRED_JOINS}."
+            f"Progress: {joined}/{REQUIRED_JOINS}.",
         )
 
 
-
 # ---------- Main ----------
-tg_app = Application.builder().token(BOT_TOKEN).build()
-tg_app.add_handler(CommandHandler("start", start))
-tg_app.add_handler(CallbackQueryHandler(verify_callback, pattern=r"^verify_"))
+_writer_task: Optional[asyncio.Task] = None
 
-if __name__ == "__main__":
-    import asyncio
-    from hypercorn.asyncio import serve
-    from hypercorn.config import Config
 
-    async def main():
-        # Start Telegram bot
-        await tg_app.initialize()
-        await tg_app.start()
-        await tg_app.updater.start_polling()
-        logger.info("🚀 Bot started and polling...")
+async def _post_init(application: Application):
+    global STATE, CHANNEL_FILE_KEYS, CHANNEL_FILES_CACHE, STATE_LOCK, SAVE_QUEUE, TG_SEM, _writer_task
+    STATE_LOCK = asyncio.Lock()
+    SAVE_QUEUE = asyncio.Queue(maxsize=1)
+    TG_SEM = asyncio.Semaphore(TG_CONCURRENCY)
+    STATE = load_state()
+    CHANNEL_FILE_KEYS, CHANNEL_FILES_CACHE = preload_channel_files(STATE["file_ids"])
+
+    # drop ids for files that were replaced or are no longer configured
+    live_keys = {key for channel_keys in CHANNEL_FILE_KEYS for key in channel_keys.values()}
+    stale = [key for key in STATE["file_ids"] if key not in live_keys]
+    for key in stale:
+        del STATE["file_ids"][key]
+    if stale:
+        mark_dirty()
+
+    _writer_task = asyncio.create_task(_writer())
+    logger.info("🚀 Bot starting, polling for updates...")
+
+
+async def _post_shutdown(application: Application):
+    if _writer_task:
+        _writer_task.cancel()
+        try:
+            await _writer_task
+        except asyncio.CancelledError:
+            pass
+    # a snapshot already handed to a worker thread must land before the final one
+    if _inflight_write is not None and not await _inflight_write:
+        mark_dirty()  # the cancelled writer could not re-mark a failed write
+    flush_state()
+
+
+def build_application() -> Application:
+    # Handler API calls share a large pool; the long poll gets its own request so it
+    # never holds one of those connections.
+    api_request = HTTPXRequest(
+        connection_pool_size=API_POOL_SIZE, read_timeout=25, write_timeout=25, pool_timeout=30
+    )
+    updates_request = HTTPXRequest(pool_timeout=30)
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(api_request)
+        .get_updates_request(updates_request)
+        # handlers only touch shared state under STATE_LOCK, so updates from
+        # different users can run concurrently; tg_call caps their API calls
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        .build()
+    )
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CallbackQueryHandler(verify_callback, pattern=VERIFY_RE))
+    return application
 
-        # Start Flask (via Hypercorn)
-        port = int(os.getenv("PORT", 5000))
-        config = Config()
-        config.bind = [f"0.0.0.0:{port}"]
-        await serve(app, config)
 
-    asyncio.run(main())
+# Only ask Telegram for the update types the handlers consume.
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
 
 
+def install_uvloop():
+    """Use the libuv-backed event loop when available (not on Windows)."""
+    try:
+        import uvloop
+    except ImportError:
+        logger.info("uvloop not installed, using the default asyncio event loop")
+    else:
+        uvloop.install()
+
+
+def run_health_server(port: int):
+    """Serve the health endpoint on its own event loop (runs in a child process)."""
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    # the child may be spawned rather than forked, so set the loop policy here too
+    install_uvloop()
+    config = Config()
+    config.bind = [f"0.0.0.0:{port}"]
+    asyncio.run(serve(health, config))
+
+
+if __name__ == "__main__":
+    import multiprocessing
+
+    install_uvloop()
+
+    # Health checks get their own process so a burst of Telegram updates can't
+    # starve them (and vice versa); it exits together with the bot. State, file
+    # preloading and the Application are all set up outside import, so a
+    # spawned child that re-imports this module only serves /.
+    port = int(os.getenv("PORT", 5000))
+    multiprocessing.Process(target=run_health_server, args=(port,), daemon=True).start()
+
+    # Telegram bot in this process; run_polling handles SIGTERM/SIGINT and
+    # runs _post_shutdown on the way out, so pending state is flushed.
+    tg_app = build_application()
+    tg_app.run_polling(
+        poll_interval=0.0,
+        timeout=POLL_TIMEOUT,
+        # get_updates adds this to timeout for the HTTP read: 5 + 30 = 35s
+        read_timeout=5,
+        drop_pending_updates=True,
+        allowed_updates=ALLOWED_UPDATES,
+    )